@@ -1,4 +1,15 @@
 import os
+
+# Size intra-op thread pools to physical cores (approximated as half the logical CPUs) before torch/MKL start
+CPU_THREADS = int(os.getenv('TORCH_NUM_THREADS', str(max(1, (os.cpu_count() or 2) // 2))))
+os.environ.setdefault('OMP_NUM_THREADS', str(CPU_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(CPU_THREADS))
+
+import json
+import hashlib
+import threading
+import numpy as np
+import orjson
 import torch
 import pdfplumber
 from datetime import datetime
@@ -9,6 +20,10 @@ from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import spacy
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from clause_labels import clause_names
 from dotenv import load_dotenv
 from reportlab.lib.pagesizes import letter
@@ -22,7 +37,24 @@ from io import BytesIO
 load_dotenv()
 UPLOAD_FOLDER = 'Uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx', 'txt'}
+# Only a preview of the extracted text is returned; originalFileUrl points at the full document
+EXTRACTED_TEXT_PREVIEW_CHARS = int(os.getenv('EXTRACTED_TEXT_PREVIEW_CHARS', '2000'))
 MODEL_DIR = './legalbert_multi_model'
+CLASSIFY_BATCH_SIZE = int(os.getenv('CLASSIFY_BATCH_SIZE', '16'))
+# Fixed padded sequence lengths so compiled/CUDA-graph shapes are reused across requests
+PAD_BUCKETS = (64, 128, 256)
+# Max number of clause predictions / recommendations kept in memory
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '8192'))
+# Serve the classifier through ONNX Runtime instead of eager PyTorch
+USE_ONNX = os.getenv('USE_ONNX', 'false').lower() == 'true'
+ONNX_MODEL_PATH = os.path.join(MODEL_DIR, 'legalbert.onnx')
+ONNX_INT8_MODEL_PATH = os.path.join(MODEL_DIR, 'legalbert-int8.onnx')
+# Compile the PyTorch classifier with CUDA graphs when running on GPU
+USE_TORCH_COMPILE = os.getenv('USE_TORCH_COMPILE', 'true').lower() == 'true'
+# Run the PyTorch classifier in FP16 on GPU and under BF16 autocast on CPU
+USE_MIXED_PRECISION = os.getenv('USE_MIXED_PRECISION', 'true').lower() == 'true'
+# Quantize the classifier's linear layers to INT8 when serving on CPU
+USE_INT8_QUANTIZATION = os.getenv('USE_INT8_QUANTIZATION', 'true').lower() == 'true'
 app = Flask(__name__)
 CORS(app)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -34,8 +66,19 @@ BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
 
 logging.basicConfig(filename='analysis.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-nlp = spacy.load("en_core_web_sm")
+torch.set_num_threads(CPU_THREADS)
+# Flask already runs requests on separate threads; avoid oversubscribing cores with inter-op threads
+torch.set_num_interop_threads(1)
+classifier_dtype = torch.float16 if device.type == 'cuda' else torch.bfloat16
+# No training path in this server (grad mode is per-thread, so inference calls also use inference_mode)
+torch.set_grad_enabled(False)
+
+# NER only needs tok2vec + ner; senter supplies ent.sent without the dependency parser
+nlp = spacy.load("en_core_web_sm", disable=["tagger", "parser", "attribute_ruler", "lemmatizer"])
+nlp.enable_pipe("senter")
+# Clause splitting only needs sentence boundaries
+nlp_sents = spacy.blank("en")
+nlp_sents.add_pipe("sentencizer")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
@@ -43,17 +86,206 @@ if not GEMINI_API_KEY:
     raise ValueError("Please set GEMINI_API_KEY in your environment variables")
 
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_MAX_WORKERS = int(os.getenv('GEMINI_MAX_WORKERS', '8'))
+# Greedy single-candidate decoding: recommendations are capped at ~50 words and cached, so sampling buys nothing
+GEMINI_GENERATION_CONFIG = {
+    "candidateCount": 1,
+    "maxOutputTokens": 120,
+    "temperature": 0.0,
+    "topK": 1
+}
+# 'clause' asks Gemini about every clause; 'label' reuses one stored recommendation per predicted clause type
+RECOMMENDATION_MODE = os.getenv('RECOMMENDATION_MODE', 'clause').lower()
+LABEL_RECOMMENDATIONS_PATH = os.getenv('LABEL_RECOMMENDATIONS_PATH', 'label_recommendations.json')
+# contract_type is free-form client input, so only this many distinct types are persisted
+LABEL_RECOMMENDATIONS_MAX_CONTRACT_TYPES = int(os.getenv('LABEL_RECOMMENDATIONS_MAX_CONTRACT_TYPES', '50'))
+
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '30'))
+GEMINI_CONNECT_TIMEOUT = 5
+
+# Shared session so clause requests reuse pooled keep-alive TLS connections
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=max(16, GEMINI_MAX_WORKERS),
+    # Retry connection failures and 429/5xx responses only: a read timeout means Gemini may
+    # still be generating, and resending the non-idempotent POST would multiply the wait
+    max_retries=Retry(
+        total=2,
+        connect=2,
+        read=0,
+        other=0,
+        status=2,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=frozenset(["POST"]),
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+))
+
+# -----------------------
+# RESULT CACHES
+# -----------------------
+class LRUCache:
+    """Thread-safe LRU map for results of recurring boilerplate clauses."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+def cache_key(text):
+    return hashlib.sha1(' '.join(text.split()).encode('utf-8')).digest()
+
+prediction_cache = LRUCache(RESULT_CACHE_SIZE)
+recommendation_cache = LRUCache(RESULT_CACHE_SIZE)
+
+def load_label_recommendations(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Stored as {contract_type: {clause_type: recommendation}}
+        return {k: v for k, v in data.items() if isinstance(v, dict)}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.error(f"Failed to load label recommendations from {path}: {e}")
+        return {}
+
+label_recommendations = load_label_recommendations(LABEL_RECOMMENDATIONS_PATH) if RECOMMENDATION_MODE == 'label' else {}
+label_recommendations_lock = threading.Lock()
 
 # -----------------------
 # LOAD MODELS
 # -----------------------
 try:
-    tokenizer_classify = AutoTokenizer.from_pretrained(MODEL_DIR)
-    model_classify = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR).to(device)
+    tokenizer_classify = AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=True)
+    load_dtype = torch.float16 if USE_MIXED_PRECISION and device.type == 'cuda' and not USE_ONNX else torch.float32
+    try:
+        # Fused scaled_dot_product_attention instead of separate matmul/softmax kernels
+        model_classify = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR, attn_implementation="sdpa", torch_dtype=load_dtype)
+    except (TypeError, ValueError) as e:
+        logging.warning(f"SDPA attention unavailable, loading eager attention: {e}")
+        model_classify = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR, torch_dtype=load_dtype)
+    model_classify.eval()
 except Exception as e:
     logging.error(f"Failed to load classification model: {e}")
     raise
 
+def is_stale(path, sources):
+    # Exported graphs must be rebuilt whenever the files they were built from change
+    if not os.path.exists(path):
+        return True
+    source_mtimes = [os.path.getmtime(source) for source in sources if os.path.exists(source)]
+    return bool(source_mtimes) and os.path.getmtime(path) < max(source_mtimes)
+
+def export_classifier_to_onnx(onnx_path):
+    # Exported from the CPU copy so the PyTorch model never has to be placed on the GPU
+    dummy = tokenizer_classify(["warm up"], return_tensors="pt", padding="max_length", max_length=256)
+    torch.onnx.export(
+        model_classify,
+        (dummy["input_ids"], dummy["attention_mask"]),
+        onnx_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "seq"},
+            "attention_mask": {0: "batch", 1: "seq"},
+            "logits": {0: "batch"}
+        },
+        opset_version=17
+    )
+    logging.info(f"Exported classification model to {onnx_path}")
+
+onnx_session = None
+if USE_ONNX:
+    try:
+        import onnxruntime as ort
+        checkpoint_files = [
+            os.path.join(MODEL_DIR, name)
+            for name in ("config.json", "model.safetensors", "pytorch_model.bin")
+        ]
+        # Workers may export concurrently; write to a per-process file and swap it in atomically
+        if is_stale(ONNX_MODEL_PATH, checkpoint_files):
+            tmp_path = f"{ONNX_MODEL_PATH}.{os.getpid()}.tmp"
+            export_classifier_to_onnx(tmp_path)
+            os.replace(tmp_path, ONNX_MODEL_PATH)
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = [p for p in ["CUDAExecutionProvider", "CPUExecutionProvider"] if p in ort.get_available_providers()]
+        onnx_path = ONNX_MODEL_PATH
+        if USE_INT8_QUANTIZATION and providers == ["CPUExecutionProvider"]:
+            if is_stale(ONNX_INT8_MODEL_PATH, [ONNX_MODEL_PATH]):
+                from onnxruntime.quantization import quantize_dynamic, QuantType
+                tmp_path = f"{ONNX_INT8_MODEL_PATH}.{os.getpid()}.tmp"
+                quantize_dynamic(ONNX_MODEL_PATH, tmp_path, weight_type=QuantType.QInt8)
+                os.replace(tmp_path, ONNX_INT8_MODEL_PATH)
+            onnx_path = ONNX_INT8_MODEL_PATH
+        onnx_session = ort.InferenceSession(onnx_path, sess_options=session_options, providers=providers)
+        logging.info(f"Serving classification model {onnx_path} with ONNX Runtime ({providers})")
+    except Exception as e:
+        logging.error(f"Failed to load ONNX classification model, falling back to PyTorch: {e}")
+        onnx_session = None
+
+if onnx_session is not None:
+    # ONNX Runtime owns the weights now; don't keep a second copy of the model in memory
+    del model_classify
+    model_classify = None
+else:
+    model_classify = model_classify.to(device)
+
+use_autocast = USE_MIXED_PRECISION
+if onnx_session is None and USE_INT8_QUANTIZATION and device.type == 'cpu':
+    try:
+        model_classify = torch.ao.quantization.quantize_dynamic(model_classify, {torch.nn.Linear}, dtype=torch.qint8)
+        # Dynamically quantized linear layers expect FP32 activations, not BF16
+        use_autocast = False
+        logging.info("Quantized classification model to INT8 for CPU inference")
+    except Exception as e:
+        logging.error(f"INT8 quantization failed, using FP32 classification model: {e}")
+
+classifier_compiled = False
+
+def run_classifier(model, inputs):
+    with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=classifier_dtype, enabled=use_autocast):
+        mark_step_begin = getattr(getattr(torch, "compiler", None), "cudagraph_mark_step_begin", None)
+        if classifier_compiled and mark_step_begin is not None:
+            mark_step_begin()
+        logits = model(**inputs).logits
+        # A compiled call returns a CUDA-graph static buffer that the next replay overwrites
+        return logits.float().clone()
+
+if onnx_session is None and USE_TORCH_COMPILE and device.type == 'cuda' and hasattr(torch, 'compile'):
+    # Compilation itself happens lazily on the first call (see warm_up_models)
+    import torch._dynamo.exc as dynamo_exc
+    eager_model_classify = model_classify
+    model_classify = torch.compile(model_classify, mode="reduce-overhead", fullgraph=True)
+    classifier_compiled = True
+    # Only compilation failures justify dropping back to eager; OOMs and bad inputs still raise
+    compile_errors = (dynamo_exc.BackendCompilerFailed, dynamo_exc.Unsupported)
+classifier_swap_lock = threading.Lock()
+
+# One dedicated thread owns every GPU forward pass, so concurrent request threads never
+# replay the model (or its CUDA graphs) at the same time
+gpu_inference_executor = None
+if onnx_session is None and device.type == 'cuda':
+    gpu_inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='classifier')
+
 # -----------------------
 # HELPERS
 # -----------------------
@@ -63,8 +295,13 @@ def allowed_file(filename):
 def extract_text(file_path):
     try:
         if file_path.endswith('.pdf'):
+            parts = []
             with pdfplumber.open(file_path) as pdf:
-                text = ''.join([page.extract_text() or '' for page in pdf.pages])
+                for page in pdf.pages:
+                    parts.append(page.extract_text() or '')
+                    # Drop the parsed layout objects so only one page is held in memory
+                    page.flush_cache()
+            text = ''.join(parts)
         else:
             with open(file_path, 'r', encoding='utf-8') as f:
                 text = f.read()
@@ -75,13 +312,16 @@ def extract_text(file_path):
         return ""
 
 def split_into_clauses(text):
-    doc = nlp(text)
+    doc = nlp_sents(text)
     clauses, buffer = [], []
+    # Running length of ' '.join(buffer), so the buffer is only joined once per clause
+    buffer_chars = 0
     for sent in doc.sents:
+        buffer_chars += len(sent.text) + (1 if buffer else 0)
         buffer.append(sent.text)
-        if len(' '.join(buffer)) > 40:
+        if buffer_chars > 40:
             clauses.append(' '.join(buffer))
-            buffer = []
+            buffer, buffer_chars = [], 0
     if buffer:
         clauses.append(' '.join(buffer))
     return [c.strip() for c in clauses if len(c.strip()) > 40]
@@ -104,40 +344,142 @@ def extract_parties(text):
         logging.error(f"Error in extract_parties: {e}")
         return []
 
-def generate_local_recommendation(prompts):
-    recommendations = []
+def move_to_device(inputs):
+    if device.type != 'cuda':
+        return inputs
+    # Pinned host buffers let the host-to-device copy run asynchronously
+    return {k: v.pin_memory().to(device, non_blocking=True) for k, v in inputs.items()}
+
+def predict_batch_probabilities(inputs):
+    if onnx_session is not None:
+        logits = onnx_session.run(None, {
+            "input_ids": inputs["input_ids"].numpy(),
+            "attention_mask": inputs["attention_mask"].numpy()
+        })[0]
+        logits = torch.from_numpy(logits)
+    elif gpu_inference_executor is not None:
+        logits = gpu_inference_executor.submit(classify_on_device, inputs).result()
+    else:
+        logits = classify_on_device(inputs)
+    return torch.sigmoid(logits).cpu().numpy()
+
+def classify_on_device(inputs):
+    return run_compiled_or_eager(move_to_device(inputs))
+
+def run_compiled_or_eager(inputs):
+    global model_classify, classifier_compiled
+    model = model_classify
+    if not classifier_compiled:
+        return run_classifier(model, inputs)
+    try:
+        return run_classifier(model, inputs)
+    except compile_errors as e:
+        with classifier_swap_lock:
+            if classifier_compiled:
+                logging.error(f"torch.compile failed, using eager classification model: {e}")
+                model_classify = eager_model_classify
+                classifier_compiled = False
+        return run_classifier(eager_model_classify, inputs)
+
+def bucket_length(length):
+    return next((bucket for bucket in PAD_BUCKETS if bucket >= length), PAD_BUCKETS[-1])
+
+def pad_batch(input_ids, attention_mask, max_length):
+    # Serving and warm-up both build batches here, so compiled graphs see identical inputs
+    return tokenizer_classify.pad(
+        {"input_ids": input_ids, "attention_mask": attention_mask},
+        padding="max_length",
+        max_length=max_length,
+        return_tensors="pt"
+    )
+
+def predict_clause_probabilities(clauses_text):
+    keys = [cache_key(clause) for clause in clauses_text]
+    predictions = [prediction_cache.get(key) for key in keys]
+    missing = [i for i, pred in enumerate(predictions) if pred is None]
+    if not missing:
+        return np.stack(predictions)
+
+    encoded = tokenizer_classify([clauses_text[i] for i in missing], truncation=True, max_length=PAD_BUCKETS[-1])
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+    # Classify cache misses sorted by token length, padding each mini-batch to the smallest bucket that fits
+    order = sorted(range(len(missing)), key=lambda k: lengths[k])
+    for start in range(0, len(order), CLASSIFY_BATCH_SIZE):
+        batch = order[start:start + CLASSIFY_BATCH_SIZE]
+        rows = batch
+        if classifier_compiled:
+            # Repeat the last clause so every compiled call sees a full batch; the extra rows are dropped below
+            rows = batch + [batch[-1]] * (CLASSIFY_BATCH_SIZE - len(batch))
+        inputs = pad_batch(
+            [encoded["input_ids"][k] for k in rows],
+            [encoded["attention_mask"][k] for k in rows],
+            bucket_length(max(lengths[k] for k in batch))
+        )
+        for k, pred_probs in zip(batch, predict_batch_probabilities(inputs)[:len(batch)]):
+            predictions[missing[k]] = pred_probs
+            prediction_cache.put(keys[missing[k]], pred_probs)
+    return np.stack(predictions)
+
+# Primes the CUDA context, kernel selection and torch.compile for every padded shape.
+# Not run at import time: Gunicorn calls it from its post_fork hook so the master never
+# touches CUDA or starts OpenMP threads before forking workers, and `python app.py`
+# (debug server with reloader) skips it entirely.
+def warm_up_models():
+    # A compiled model only ever sees full CLASSIFY_BATCH_SIZE batches; CUDA-graph
+    # capture needs a few runs per shape to settle. On CUDA these calls run on the same
+    # inference thread as serving, which matters because torch keeps CUDA-graph trees per thread.
+    passes = 3 if classifier_compiled else 1
+    try:
+        encoded = tokenizer_classify(["warm up"] * CLASSIFY_BATCH_SIZE, truncation=True, max_length=PAD_BUCKETS[-1])
+        for max_length in PAD_BUCKETS:
+            dummy = pad_batch(encoded["input_ids"], encoded["attention_mask"], max_length)
+            for _ in range(passes):
+                predict_batch_probabilities(dummy)
+        logging.info("Classification model warmed up")
+    except Exception as e:
+        logging.error(f"Error warming up classification model: {e}")
+
+def generate_single_recommendation(prompt):
+    key = cache_key(prompt)
+    cached = recommendation_cache.get(key)
+    if cached is not None:
+        return cached
     headers = {"Content-Type": "application/json"}
-    for prompt in prompts:
-        try:
-            payload = {
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {
-                    "maxOutputTokens": 256,
-                    "temperature": 0.7,
-                    "topP": 0.9
-                }
-            }
-            response = requests.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", json=payload, headers=headers)
-            response.raise_for_status()
-            result = response.json()
-            logging.info(f"Gemini raw response: {result}")
-
-            candidates = result.get("candidates", [])
-            if candidates and "content" in candidates[0] and "parts" in candidates[0]["content"]:
-                parts = candidates[0]["content"]["parts"]
-                if parts and "text" in parts[0]:
-                    recommendation = parts[0]["text"].strip()
-                else:
-                    recommendation = ""
+    try:
+        payload = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": GEMINI_GENERATION_CONFIG
+        }
+        response = http_session.post(f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", json=payload, headers=headers, timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_TIMEOUT))
+        response.raise_for_status()
+        result = response.json()
+        logging.info(f"Gemini raw response: {result}")
+
+        candidates = result.get("candidates", [])
+        if candidates and "content" in candidates[0] and "parts" in candidates[0]["content"]:
+            parts = candidates[0]["content"]["parts"]
+            if parts and "text" in parts[0]:
+                recommendation = parts[0]["text"].strip()
             else:
                 recommendation = ""
+        else:
+            recommendation = ""
 
-            recommendation = recommendation.replace("**", "").replace("#", "").strip()
-            recommendations.append(recommendation if recommendation else "No recommendation generated")
-        except Exception as e:
-            logging.error(f"Error generating recommendations with Gemini: {e}")
-            recommendations.append("Error generating recommendation")
-    return recommendations
+        recommendation = recommendation.replace("**", "").replace("#", "").strip()
+        if not recommendation:
+            return "No recommendation generated"
+        recommendation_cache.put(key, recommendation)
+        return recommendation
+    except Exception as e:
+        logging.error(f"Error generating recommendations with Gemini: {e}")
+        return "Error generating recommendation"
+
+def generate_local_recommendation(prompts):
+    if len(prompts) <= 1:
+        return [generate_single_recommendation(prompt) for prompt in prompts]
+    # Issue the Gemini calls concurrently; map() keeps results in prompt order
+    with ThreadPoolExecutor(max_workers=min(GEMINI_MAX_WORKERS, len(prompts))) as executor:
+        return list(executor.map(generate_single_recommendation, prompts))
 
 def generate_clause_prompts(clauses, contract_type="general contract"):
     return [
@@ -148,6 +490,50 @@ def generate_clause_prompts(clauses, contract_type="general contract"):
         for clause in clauses
     ]
 
+def generate_label_prompt(label, contract_type="general contract"):
+    return (
+        f"You are a legal expert specializing in contract analysis for India, EU (GDPR), and US (CCPA) jurisdictions. "
+        f"A {contract_type} contains a clause classified as '{label}'. "
+        f"Describe the key compliance checks and legal risks for this type of clause as a concise, professional recommendation (1-2 sentences, max 50 words). "
+        f"Do not use markdown, headings, or say 'No recommendation'."
+    )
+
+def normalize_contract_type(contract_type):
+    normalized = ' '.join(str(contract_type).lower().split())[:64]
+    return normalized or "general contract"
+
+def save_label_recommendations(contract_type, new_entries):
+    with label_recommendations_lock:
+        if contract_type not in label_recommendations and len(label_recommendations) >= LABEL_RECOMMENDATIONS_MAX_CONTRACT_TYPES:
+            logging.warning(f"Label recommendation store is full, not persisting contract type '{contract_type}'")
+            return
+        label_recommendations.setdefault(contract_type, {}).update(new_entries)
+        try:
+            tmp_path = f"{LABEL_RECOMMENDATIONS_PATH}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(label_recommendations, f, indent=2)
+            os.replace(tmp_path, LABEL_RECOMMENDATIONS_PATH)
+        except Exception as e:
+            logging.error(f"Failed to save label recommendations: {e}")
+
+def generate_label_recommendations(clause_types, contract_type="general contract"):
+    contract_type = normalize_contract_type(contract_type)
+    with label_recommendations_lock:
+        stored = dict(label_recommendations.get(contract_type, {}))
+    missing = sorted({clause_type for clause_type in clause_types if clause_type not in stored})
+    if missing:
+        # Only clause types never seen before for this contract type go to Gemini
+        prompts = [generate_label_prompt(clause_type, contract_type) for clause_type in missing]
+        generated = dict(zip(missing, generate_local_recommendation(prompts)))
+        new_entries = {
+            clause_type: rec for clause_type, rec in generated.items()
+            if rec not in ("No recommendation generated", "Error generating recommendation")
+        }
+        if new_entries:
+            save_label_recommendations(contract_type, new_entries)
+        stored.update(generated)
+    return [stored.get(clause_type, "No recommendation") for clause_type in clause_types]
+
 def generate_overall_summary(clauses):
     total_clauses = len(clauses)
     risky_clauses = sum(1 for c in clauses if c["complianceStatus"] != "compliant")
@@ -166,38 +552,42 @@ def analyze_clauses(text, contract_type="general contract"):
         if not clauses_text:
             clauses_text = [text]
 
-        inputs = tokenizer_classify(clauses_text, return_tensors="pt", padding=True, truncation=True, max_length=256).to(device)
-        outputs = model_classify(**inputs)
-        predictions = torch.sigmoid(outputs.logits).detach().cpu().tolist()
-
-        prompts = generate_clause_prompts(clauses_text, contract_type)
-        recommendations = generate_local_recommendation(prompts)
+        predictions = predict_clause_probabilities(clauses_text)  # (num_clauses, num_labels)
+        avg_conf = predictions.mean(axis=1)
+        scores = predictions.max(axis=1)
+        hits = predictions > 0.5
+        first_hit = hits.argmax(axis=1)
+        clause_types = [
+            clause_names[j] if has_label else "Uncategorized"
+            for j, has_label in zip(first_hit.tolist(), hits.any(axis=1).tolist())
+        ]
+        statuses = np.select([avg_conf > 0.75, avg_conf > 0.5], ["compliant", "review_needed"], default="non_compliant").tolist()
+        risks = np.select([scores > 0.75, scores > 0.5], ["low", "medium"], default="high").tolist()
+
+        if RECOMMENDATION_MODE == 'label':
+            recommendations = generate_label_recommendations(clause_types, contract_type)
+        else:
+            prompts = generate_clause_prompts(clauses_text, contract_type)
+            recommendations = generate_local_recommendation(prompts)
 
-        result_clauses = []
         clause_weights = {
             "Indemnification": 2.0, "Termination": 1.5, "Confidentiality": 1.2,
             "Payment Terms": 1.0, "Liability": 1.0, "Uncategorized": 0.5
         }
-
-        for i, (text_clause, pred_probs) in enumerate(zip(clauses_text, predictions)):
-            labels = [clause_names[j] for j, p in enumerate(pred_probs) if p > 0.5]
-            avg_conf = sum(pred_probs) / len(pred_probs) if pred_probs else 0.0
-            score = max(pred_probs) if pred_probs else 0.0
-            status = "compliant" if avg_conf > 0.75 else "review_needed" if avg_conf > 0.5 else "non_compliant"
-            risk = "low" if score > 0.75 else "medium" if score > 0.5 else "high"
-            result_clauses.append({
+        result_clauses = [
+            {
                 "id": i + 1,
-                "type": labels[0] if labels else "Uncategorized",
+                "type": clause_types[i],
                 "text": text_clause,
-                "complianceStatus": status,
-                "riskLevel": risk,
+                "complianceStatus": statuses[i],
+                "riskLevel": risks[i],
                 "recommendation": recommendations[i] if i < len(recommendations) else "No recommendation"
-            })
+            }
+            for i, text_clause in enumerate(clauses_text)
+        ]
 
-        compliance_score = sum(
-            max(pred) * clause_weights.get(c["type"], 1.0)
-            for c, pred in zip(result_clauses, predictions)
-        ) / sum(clause_weights.get(c["type"], 1.0) for c in result_clauses) if result_clauses else 0
+        weights = np.array([clause_weights.get(clause_type, 1.0) for clause_type in clause_types])
+        compliance_score = float((scores * weights).sum() / weights.sum()) if result_clauses else 0
         compliance_score = int(compliance_score * 100)
 
         overall_summary_prompt = (
@@ -214,7 +604,8 @@ def analyze_clauses(text, contract_type="general contract"):
             "fileName": None,
             "fileSize": None,
             "uploadedAt": datetime.utcnow().isoformat() + "Z",
-            "extractedText": text,
+            "extractedText": text[:EXTRACTED_TEXT_PREVIEW_CHARS],
+            "extractedTextTruncated": len(text) > EXTRACTED_TEXT_PREVIEW_CHARS,
             "clauses": result_clauses,
             "complianceScore": compliance_score,
             "totalClauses": len(result_clauses),
@@ -229,7 +620,8 @@ def analyze_clauses(text, contract_type="general contract"):
             "fileName": None,
             "fileSize": None,
             "uploadedAt": datetime.utcnow().isoformat() + "Z",
-            "extractedText": text,
+            "extractedText": text[:EXTRACTED_TEXT_PREVIEW_CHARS],
+            "extractedTextTruncated": len(text) > EXTRACTED_TEXT_PREVIEW_CHARS,
             "clauses": [],
             "complianceScore": 0,
             "totalClauses": 0,
@@ -287,6 +679,10 @@ def generate_pdf_report(analysis):
         logging.error(f"Error generating PDF report: {e}")
         raise
 
+def orjson_response(payload, status=200):
+    # orjson serializes the nested analysis dict several times faster than jsonify's stdlib encoder
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
 # -----------------------
 # API ROUTES
 # -----------------------
@@ -312,7 +708,7 @@ def upload_file():
             analysis["originalFileUrl"] = f"{BASE_URL}{app.config['UPLOAD_FOLDER_URL']}/{filename}"
             logging.info(f"Generated analysis with originalFileUrl: {analysis['originalFileUrl']}")
 
-            return jsonify(analysis), 200
+            return orjson_response(analysis, 200)
     except Exception as e:
         logging.error(f"Error in upload_file: {e}")
         return jsonify({'error': str(e)}), 500
@@ -351,6 +747,7 @@ def submit_feedback():
 # -----------------------
 # RUN SERVER
 # -----------------------
+# Development server only; production runs under Gunicorn via wsgi.py
 if __name__ == '__main__':
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import ctypes
+from dotenv import load_dotenv
+
+# Same .env as app.py, so USE_ONNX and thread settings set there are seen here too
+load_dotenv()
+
+
+def has_cuda_gpu():
+    # Ask NVML directly instead of importing torch: the arbiter must not load torch/libgomp
+    # before the thread settings below are in the environment, nor initialize CUDA before forking
+    if os.getenv('CUDA_VISIBLE_DEVICES') in ('', '-1'):
+        return False
+    try:
+        nvml = ctypes.CDLL('libnvidia-ml.so.1')
+    except OSError:
+        return False
+    if nvml.nvmlInit_v2() != 0:
+        return False
+    try:
+        count = ctypes.c_uint(0)
+        return nvml.nvmlDeviceGetCount_v2(ctypes.byref(count)) == 0 and count.value > 0
+    finally:
+        nvml.nvmlShutdown()
+
+
+HAS_CUDA = has_cuda_gpu()
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+# A GPU holds one model copy and CUDA context per worker, so default to a single worker there.
+# Its request threads mostly wait on Gemini; classifier calls are serialized on one inference thread.
+workers = int(os.getenv('GUNICORN_WORKERS', '1' if HAS_CUDA else '4'))
+threads = int(os.getenv('GUNICORN_THREADS', '4' if HAS_CUDA else '2'))
+USE_ONNX = os.getenv('USE_ONNX', 'false').lower() == 'true'
+# Load the models once in the master process so CPU workers share the weights copy-on-write.
+# CUDA cannot be used in a child forked after the parent initialized it, and an ONNX Runtime
+# session's thread pool (plus the export forward pass) does not survive a fork either, so in
+# those setups each worker loads its own models instead.
+preload_app = not HAS_CUDA and not USE_ONNX
+# Large contracts can take a while to classify and annotate
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+
+# This file is read before app.py is imported: split the physical cores (approximated as half
+# the logical CPUs, as in app.py) between all worker threads instead of giving each the full count
+physical_cores = max(1, (os.cpu_count() or 2) // 2)
+os.environ.setdefault('TORCH_NUM_THREADS', str(max(1, physical_cores // (workers * threads))))
+# OpenMP/MKL read these when they are loaded, which happens when a worker (or the preloading
+# master) imports app.py, so they have to be in place before then
+os.environ.setdefault('OMP_NUM_THREADS', os.environ['TORCH_NUM_THREADS'])
+os.environ.setdefault('MKL_NUM_THREADS', os.environ['TORCH_NUM_THREADS'])
+
+
+def post_fork(server, worker):
+    # Warm up inside each worker, never in the master, so CUDA/OpenMP state is not inherited across fork
+    from app import warm_up_models
+    warm_up_models()